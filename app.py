@@ -9,92 +9,683 @@ Resumo:
 - Postagens são replicadas assincronamente para peers.
 - Suporta autenticação simples (login por usuário/senha -> token).
 - Permite simular queda temporária (ignorar replicações) e reconciliar mensagens ao reconectar.
-- Persistência simples: salva mensagens em arquivo JSON para sobreviver reinícios (opcional).
+- Persistência simples: log append-only de mensagens (JSON lines) para sobreviver reinícios.
 """
 
 import argparse
+import asyncio
+import atexit
+import base64
+import bisect
+import collections
+import gzip
+import hashlib
+import hmac
 import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
 import time
 import json
 import os
 import uuid
+import zlib
+from urllib.parse import quote
 from datetime import datetime
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson  # opcional: serialização JSON bem mais rápida nos caminhos quentes
+except ImportError:
+    orjson = None
+
+# ---------- Serialização JSON ----------
+def json_dumps(obj):
+    """Serializa para bytes UTF-8 (orjson se disponível, senão json da stdlib)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_loads(data):
+    """Desserializa bytes/str JSON (levanta ValueError se inválido)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_response(obj, status=200):
+    """Resposta JSON serializada direto para bytes, sem passar pelo jsonify."""
+    return Response(json_dumps(obj), status=status, mimetype="application/json")
+
+MAX_REQUEST_BODY = 16 * 1024 * 1024  # limite do corpo recebido, antes e depois de descomprimir
+
+def _gunzip_limited(body, limit):
+    """Descomprime gzip sem passar de `limit` bytes (None se inválido ou grande demais)."""
+    try:
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = d.decompress(body, limit + 1)
+    except zlib.error:
+        return None
+    if len(out) > limit or d.unconsumed_tail or not d.eof:
+        return None
+    return out
+
+def request_json(allow_gzip=False):
+    """
+    Lê o corpo da requisição como JSON (independente do Content-Type); None se inválido.
+    Com allow_gzip (só nos endpoints entre peers) aceita Content-Encoding: gzip, limitado
+    a MAX_REQUEST_BODY bytes descomprimidos.
+    """
+    body = request.get_data()
+    encoding = request.headers.get("Content-Encoding", "").lower()
+    if encoding == "gzip" and allow_gzip:
+        body = _gunzip_limited(body, MAX_REQUEST_BODY)
+        if body is None:
+            return None
+    elif encoding not in ("", "identity"):
+        return None
+    try:
+        return json_loads(body)
+    except ValueError:
+        return None
+
+# ---------- Compressão HTTP ----------
+COMPRESS_MIN_SIZE = 512  # corpos menores que isso não compensam a compressão
+COMPRESS_LEVEL = 6
+
+def json_body(obj):
+    """Corpo JSON para enviar a um peer: (dados, headers), comprimido com gzip se for grande."""
+    data = json_dumps(obj)
+    headers = {"Content-Type": "application/json"}
+    if len(data) >= COMPRESS_MIN_SIZE:
+        data = gzip.compress(data, COMPRESS_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return data, headers
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Faz o jsonify do Flask usar orjson."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BODY
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+@app.after_request
+def compress_response(response):
+    """Comprime com gzip respostas JSON grandes quando o cliente aceita (ex.: /messages)."""
+    response.vary.add("Accept-Encoding")
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype != "application/json"
+            or "gzip" not in request.headers.get("Accept-Encoding", "").lower()):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(body, COMPRESS_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
 
 # ---------- Configuração e Estado do Nó ----------
-lock = threading.Lock()  # trava para acesso concorrente ao mural e outros estados
+class RWLock:
+    """
+    Trava leitores-escritor: vários leitores simultâneos ou um único escritor.
+    Escritores aguardando têm prioridade sobre novos leitores (evita starvation de /post).
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class ShardedDict:
+    """Dicionário dividido em shards, cada um com sua trava: chaves diferentes raramente disputam."""
+    def __init__(self, n=16):
+        self.shards = [{} for _ in range(n)]
+        self.locks = [threading.Lock() for _ in range(n)]
+
+    def _index(self, key):
+        return hash(key) % len(self.shards)
+
+    def get(self, key, default=None):
+        i = self._index(key)
+        with self.locks[i]:
+            return self.shards[i].get(key, default)
+
+    def set(self, key, value):
+        i = self._index(key)
+        with self.locks[i]:
+            self.shards[i][key] = value
+
+    def pop(self, key, default=None):
+        i = self._index(key)
+        with self.locks[i]:
+            return self.shards[i].pop(key, default)
+
+    def remove_if(self, predicate):
+        """Remove as entradas cujo (chave, valor) satisfaz o predicado; trava um shard por vez."""
+        removed = 0
+        for shard, shard_lock in zip(self.shards, self.locks):
+            with shard_lock:
+                expired = [k for k, v in shard.items() if predicate(k, v)]
+                for k in expired:
+                    del shard[k]
+            removed += len(expired)
+        return removed
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+class ShardedSet:
+    """Conjunto dividido em shards com travas próprias (deduplicação de IDs sem trava global)."""
+    def __init__(self, n=16):
+        self.shards = [set() for _ in range(n)]
+        self.locks = [threading.Lock() for _ in range(n)]
+
+    def _index(self, item):
+        return hash(item) % len(self.shards)
+
+    def add(self, item):
+        """Adiciona o item; retorna False se ele já existia (checagem e inserção atômicas)."""
+        i = self._index(item)
+        with self.locks[i]:
+            if item in self.shards[i]:
+                return False
+            self.shards[i].add(item)
+            return True
+
+    def __contains__(self, item):
+        i = self._index(item)
+        with self.locks[i]:
+            return item in self.shards[i]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+class TTLCache:
+    """
+    Cache pequeno com expiração por entrada. Leituras não usam trava (dict.get é atômico
+    no CPython); escritas e remoções usam a trava. Ao encher, descarta a entrada mais antiga.
+    `clock` é a fonte de tempo (segundos monotônicos); trocável nos testes.
+    """
+    def __init__(self, maxsize=4096, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[1] < self.clock():
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Guarda o valor; `ttl` permite uma expiração menor que a padrão para esta entrada."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self.maxsize:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (value, self.clock() + ttl)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class MerkleTree:
+    """
+    Árvore de Merkle de forma fixa sobre os IDs das mensagens, usada na reconciliação.
+    As mensagens são distribuídas em `leaves` buckets por faixas de `span` valores do contador
+    de Lamport (circular): mensagens recentes, de contadores próximos, caem em poucos buckets
+    vizinhos, e o bucket de uma mensagem é o mesmo em qualquer nó.
+    Nós em heap: raiz = 1, filhos de i = 2i e 2i+1, folhas em [leaves, 2*leaves).
+    Folha = sha256 dos IDs ordenados do bucket; nó interno = sha256(esquerdo || direito).
+    """
+    def __init__(self, leaves=1024, span=8):
+        self.leaves = leaves
+        self.span = span
+        self.depth = leaves.bit_length() - 1  # níveis abaixo da raiz (leaves é potência de 2)
+        self.nodes = [b""] * (2 * leaves)
+        self.buckets = [[] for _ in range(leaves)]
+        self.rebuild([])
+
+    def bucket_of(self, msg):
+        return (msg["counter"] // self.span) % self.leaves
+
+    def _hash_leaf(self, b):
+        ids = sorted(m["id"] for m in self.buckets[b])
+        self.nodes[self.leaves + b] = hashlib.sha256("\n".join(ids).encode("utf-8")).digest()
+
+    def _hash_inner(self, i):
+        self.nodes[i] = hashlib.sha256(self.nodes[2 * i] + self.nodes[2 * i + 1]).digest()
+
+    def rebuild(self, messages):
+        """Reconstrói a árvore inteira (usado na carga inicial)."""
+        self.buckets = [[] for _ in range(self.leaves)]
+        for msg in messages:
+            self.buckets[self.bucket_of(msg)].append(msg)
+        for b in range(self.leaves):
+            self._hash_leaf(b)
+        for i in range(self.leaves - 1, 0, -1):
+            self._hash_inner(i)
+
+    def add_many(self, msgs):
+        """
+        Insere um lote de mensagens recalculando cada folha alterada e cada ancestral
+        uma única vez, nível a nível até a raiz.
+        """
+        dirty = set()
+        for msg in msgs:
+            b = self.bucket_of(msg)
+            self.buckets[b].append(msg)
+            dirty.add(b)
+        for b in dirty:
+            self._hash_leaf(b)
+        level = {(self.leaves + b) // 2 for b in dirty}
+        while level:
+            for i in level:
+                self._hash_inner(i)
+            level = {i // 2 for i in level if i > 1}
+
+    def root(self):
+        return self.nodes[1].hex()
+
+    def hashes(self, indices):
+        """Hashes dos nós pedidos (None para índices fora da árvore)."""
+        return [self.nodes[i].hex() if 1 <= i < 2 * self.leaves else None for i in indices]
+
+    def bucket(self, b):
+        """Mensagens do bucket b (None se b estiver fora do intervalo)."""
+        if not 0 <= b < self.leaves:
+            return None
+        return self.buckets[b]
+
+class BloomFilter:
+    """
+    Filtro de Bloom simples (~10 bits por elemento, k=7) sobre IDs de mensagens.
+    Usado na reconciliação: o peer devolve só as mensagens que não estão no filtro.
+    """
+    MAX_K = 32  # o filtro vem de fora (rota sem autenticação) e o custo da consulta cresce com k
+    def __init__(self, m, k=7, bits=None):
+        self.m = m
+        self.k = k
+        self.bits = bits if bits is not None else bytearray((m + 7) // 8)
+
+    @classmethod
+    def for_items(cls, items, bits_per_item=10, k=7):
+        bloom = cls(max(1024, bits_per_item * len(items)), k)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def to_dict(self):
+        return {"m": self.m, "k": self.k, "bits": base64.b64encode(bytes(self.bits)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        bloom = cls(int(data["m"]), int(data["k"]), bytearray(base64.b64decode(data["bits"])))
+        if bloom.m <= 0 or len(bloom.bits) != (bloom.m + 7) // 8 or not 1 <= bloom.k <= cls.MAX_K:
+            raise ValueError("invalid bloom filter")
+        return bloom
+
+messages_lock = RWLock()  # trava do mural (messages, contador e pendências de persistência)
 
 class NodeState:
-    def __init__(self, node_id, port, peers):
+    def __init__(self, node_id, port, peers, persist_interval=0.5, session_ttl=3600):
         self.node_id = node_id
         self.port = port
         # peers: lista de "http://host:port"
         self.peers = peers
 
-        # messages: lista de dicts: {id, node_id, counter, timestamp_iso, user, text}
+        # messages: lista de dicts: {id, node_id, counter, lamport, timestamp_iso, user, text}
+        # (mensagens antigas não trazem lamport)
         self.messages = []
-        # message_ids para deduplicação rápida
-        self.message_ids = set()
-        # counter local para criar IDs únicos
+        # message_keys: chaves de ordenação (Lamport, inteiros) paralelas a messages, para bisect
+        self.message_keys = []
+        # message_ids para deduplicação rápida (shards com travas próprias)
+        self.message_ids = ShardedSet()
+        # árvore de Merkle sobre os IDs, para reconciliar trocando só os buckets divergentes
+        self.merkle = MerkleTree()
+        # filtro de Bloom dos IDs locais (serializado), reconstruído sob demanda após alterações
+        self._bloom = None
+        # corpo JSON pré-serializado de /messages (+ ETag e versão gzip), invalidado a cada escrita
+        self._msgs_cache = None
+        # relógio de Lamport local: gera IDs únicos e a ordem causal das mensagens
         self.local_counter = 0
+        # version vector: node_id -> maior contador já visto de mensagens daquele nó
+        self.vv = {}
+        # lacunas de version vector em aberto por peer: peer_url -> {node_id: (contador, visto_em)}
+        self.vv_gaps = {}
 
-        # Simple user store: username -> password (plain for demo).
-        # Em produção: use hashing seguro (bcrypt) e store persistente.
+        # Simple user store: username -> (salt, hash PBKDF2) das senhas de demonstração.
+        # Em produção: store persistente de usuários.
         self.users = {
-            "alice": "password1",
-            "bob": "password2",
-            "carol": "password3"
+            username: hash_password(password) for username, password in {
+                "alice": "password1",
+                "bob": "password2",
+                "carol": "password3"
+            }.items()
         }
-        # sessions: token -> username
-        self.sessions = {}
+        # sessions: token -> {"user", "created"} (shards com travas próprias).
+        # Expiram após session_ttl segundos; um sweeper remove as vencidas periodicamente
+        self.sessions = ShardedDict()
+        self.session_ttl = session_ttl
+        # token_cache: token -> username, atende o caminho quente de /post sem travas
+        self.token_cache = TTLCache(maxsize=4096, ttl=60)
 
         # If accept_replication is False -> simulate node down for replication
         self.accept_replication = True
 
-        # persistence filename
-        self.persist_file = f"messages_{self.node_id}.json"
+        # Cliente HTTP compartilhado (keep-alive/pool de conexões por peer) e pool de workers
+        # da replicação, reaproveitados por todas as postagens
+        self.http = requests.Session()
+        self.http.headers["Accept-Encoding"] = "gzip"
+        adapter = HTTPAdapter(pool_connections=max(1, len(peers)), pool_maxsize=32, max_retries=0)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max(8, 4 * len(peers)), thread_name_prefix="replicate")
+        # Event loop dedicado à replicação: coordena o fan-out e os backoffs de todos os
+        # peers em uma única thread; workers do pool só ficam ocupados durante o HTTP
+        self.loop = asyncio.new_event_loop()
+        # filas de saída por peer, esvaziadas em lotes pelo event loop
+        self.outbox = {peer: collections.deque(maxlen=REPLICATION_QUEUE_MAX) for peer in peers}
+        self.outbox_wakeup = {}
+
+        # persistence: log append-only em JSON lines (uma mensagem por linha)
+        self.persist_file = f"messages_{self.node_id}.ndjson"
+        # arquivo do formato antigo (snapshot JSON completo), migrado na primeira carga
+        self.legacy_persist_file = f"messages_{self.node_id}.json"
+        # _pending: mensagens novas ainda não gravadas; _dirty sinaliza que há pendências.
+        # O flusher agrupa várias mensagens em uma única escrita a cada persist_interval segundos
+        self.persist_interval = persist_interval
+        self._pending = []
+        self._dirty = threading.Event()
+        self._persist_lock = threading.Lock()
         # load on startup
         self._load_persisted()
+        self._open_log()
 
     def _load_persisted(self):
-        if os.path.exists(self.persist_file):
-            try:
-                with open(self.persist_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.messages = data.get("messages", [])
-                    self.message_ids = set(m["id"] for m in self.messages)
-                    self.local_counter = data.get("local_counter", self.local_counter)
-                print(f"[{self.node_id}] Loaded {len(self.messages)} persisted messages.")
-            except Exception as e:
-                print(f"[{self.node_id}] Erro ao carregar persistência: {e}")
+        if not os.path.exists(self.persist_file):
+            self._load_legacy()
+            return
+        try:
+            lines = 0
+            with open(self.persist_file, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    try:
+                        msg = json_loads(line)
+                    except ValueError:
+                        # linha truncada (queda no meio de uma escrita): ignora
+                        continue
+                    # registros com formato inválido (gravados por versões antigas) são descartados:
+                    # IDs que não são str quebrariam o filtro de Bloom e a árvore de Merkle
+                    if not valid_message(msg) or not self.message_ids.add(msg["id"]):
+                        continue
+                    self.messages.append(msg)
+            self._finish_load()
+            # compacta o log se ele tiver crescido além do dobro das mensagens válidas
+            if lines > 2 * len(self.messages):
+                self._rewrite_log()
+            print(f"[{self.node_id}] Loaded {len(self.messages)} persisted messages.")
+        except Exception as e:
+            print(f"[{self.node_id}] Erro ao carregar persistência: {e}")
 
-    def _persist(self):
+    def _load_legacy(self):
+        """Carrega o snapshot JSON do formato antigo (se existir) e o converte para o log."""
+        if not os.path.exists(self.legacy_persist_file):
+            return
         try:
-            with open(self.persist_file, "w", encoding="utf-8") as f:
-                json.dump({
-                    "messages": self.messages,
-                    "local_counter": self.local_counter
-                }, f, ensure_ascii=False, indent=2)
+            with open(self.legacy_persist_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.messages = [m for m in data.get("messages", [])
+                             if valid_message(m) and self.message_ids.add(m["id"])]
+            self._finish_load()
+            self.local_counter = max(self.local_counter, data.get("local_counter", 0))
+            self._rewrite_log()
+            print(f"[{self.node_id}] Migrated {len(self.messages)} messages from {self.legacy_persist_file}.")
         except Exception as e:
-            print(f"[{self.node_id}] Erro ao persistir: {e}")
+            print(f"[{self.node_id}] Erro ao carregar persistência: {e}")
+
+    def _finish_load(self):
+        """Ordena o mural carregado e recupera o relógio de Lamport a partir das mensagens."""
+        self.messages.sort(key=order_key)
+        self.message_keys = [order_key(m) for m in self.messages]
+        self.merkle.rebuild(self.messages)
+        self.local_counter = max((m.get("counter", 0) for m in self.messages), default=self.local_counter)
+        for m in self.messages:
+            update_vv(self.vv, m)
+
+    def _rewrite_log(self):
+        """Reescreve o log apenas com as mensagens válidas (escrita atômica via os.replace)."""
+        tmp_file = self.persist_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            for msg in self.messages:
+                f.write(json_dumps(msg) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.persist_file)
+
+    def _open_log(self):
+        """
+        Abre o log para acréscimo. Se a última linha ficou truncada (queda ou erro no meio de
+        uma escrita), termina-a com uma quebra de linha para não corromper o próximo registro.
+        """
+        with open(self.persist_file, "ab+") as f:
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        self.persist_fh = open(self.persist_file, "ab", buffering=1 << 16)
+
+    def _append(self, msgs):
+        """Acrescenta as mensagens ao log com um único flush/fsync para o lote."""
+        for msg in msgs:
+            self.persist_fh.write(json_dumps(msg) + b"\n")
+        self.persist_fh.flush()
+        os.fsync(self.persist_fh.fileno())
+
+    def _persist(self):
+        """Grava no log as mensagens pendentes acumuladas desde a última gravação."""
+        with self._persist_lock:
+            with messages_lock.write():
+                batch = self._pending
+                self._pending = []
+                self._dirty.clear()
+            if not batch:
+                return
+            try:
+                self._append(batch)
+            except Exception as e:
+                print(f"[{self.node_id}] Erro ao persistir: {e}")
+                # devolve o lote para a frente da fila; o flusher tenta de novo no próximo intervalo
+                with messages_lock.write():
+                    self._pending[:0] = batch
+                    self._dirty.set()
+                # descarta o buffer do arquivo (pode ter ficado pela metade) e reabre o log
+                try:
+                    self.persist_fh.close()
+                except Exception:
+                    pass
+                try:
+                    self._open_log()
+                except Exception as e:
+                    print(f"[{self.node_id}] Erro ao reabrir o log: {e}")
+
+    def _flush_loop(self):
+        """Thread de persistência: espera alterações e grava no máximo uma vez por intervalo."""
+        while True:
+            self._dirty.wait()
+            time.sleep(self.persist_interval)
+            self._persist()
+
+    def session_expired(self, sess, now=None):
+        return (time.time() if now is None else now) - sess["created"] >= self.session_ttl
+
+    def _sweep_sessions_loop(self):
+        """Thread que remove sessões vencidas (evita crescimento sem limite de sessions)."""
+        while True:
+            time.sleep(min(self.session_ttl, 60))
+            now = time.time()
+            removed = self.sessions.remove_if(lambda token, sess: self.session_expired(sess, now))
+            if removed:
+                print(f"[{self.node_id}] {removed} sessões expiradas removidas")
+
+    def start_session_sweeper(self):
+        """Inicia a thread de limpeza de sessões expiradas."""
+        threading.Thread(target=self._sweep_sessions_loop, daemon=True).start()
+
+    def start_persistence(self):
+        """Inicia o flusher em background e garante a gravação final ao encerrar o processo."""
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush_now)
+
+    def start_replicator(self):
+        """Inicia a thread do event loop de replicação e um drenador de fila por peer."""
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        for peer in self.peers:
+            asyncio.run_coroutine_threadsafe(_drain_outbox(peer), self.loop)
+
+    def flush_now(self):
+        """Grava imediatamente se houver alterações pendentes."""
+        if self._dirty.is_set():
+            self._persist()
 
 state = None  # será inicializado no main
 
 # ---------- Utilitários ----------
+PBKDF2_ITERATIONS = 100_000
+
+def hash_password(password, salt=None):
+    """Gera (salt, hash) PBKDF2-SHA256 da senha."""
+    if salt is None:
+        salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PBKDF2_ITERATIONS)
+    return salt, digest
+
+def verify_password(password, stored):
+    """Compara a senha com o (salt, hash) armazenado em tempo constante."""
+    salt, digest = stored
+    return hmac.compare_digest(hash_password(password, salt)[1], digest)
+
+def lamport_key(counter, node_id):
+    """Chave de ordenação inteira: contador de Lamport nos bits altos, hash do nó nos 16 baixos (desempate)."""
+    return (counter << 16) | (zlib.crc32(node_id.encode("utf-8")) & 0xFFFF)
+
+MAX_COUNTER = 1 << 47  # contador << 16 precisa caber em um int64 (limite do orjson)
+MAX_INT64 = 1 << 63
+
+def _is_int(value, limit):
+    return type(value) is int and 0 <= value < limit
+
+def valid_message(msg):
+    """
+    Confere o formato de uma mensagem recebida de fora (peer ou disco) antes de aceitá-la:
+    id/node_id/user/text em str, counter inteiro, lamport inteiro que caiba em int64.
+    """
+    return (isinstance(msg, dict)
+            and isinstance(msg.get("id"), str) and msg["id"] != ""
+            and isinstance(msg.get("node_id"), str)
+            and isinstance(msg.get("user"), str)
+            and isinstance(msg.get("text"), str)
+            and _is_int(msg.get("counter"), MAX_COUNTER)
+            and ("lamport" not in msg or _is_int(msg["lamport"], MAX_INT64))
+            and ("timestamp" not in msg or isinstance(msg["timestamp"], str)))
+
+def order_key(msg):
+    """Chave de ordenação da mensagem (calculada para mensagens antigas sem o campo "lamport")."""
+    key = msg.get("lamport")
+    if key is None:
+        key = lamport_key(msg.get("counter", 0), msg.get("node_id", ""))
+    return key
+
+_rand_pool = threading.local()  # bytes aleatórios pré-sorteados, por thread
+
+def _fast_hex6():
+    """6 dígitos hex aleatórios tirados de um buffer por thread (um os.urandom a cada 128 IDs)."""
+    buf = getattr(_rand_pool, "buf", b"")
+    if len(buf) < 3:
+        buf = os.urandom(384)
+    _rand_pool.buf = buf[3:]
+    return buf[:3].hex()
+
+def update_vv(vv, msg):
+    """Avança o version vector com o contador da mensagem."""
+    node, counter = msg.get("node_id", ""), msg.get("counter", 0)
+    if counter > vv.get(node, 0):
+        vv[node] = counter
+
+def current_vv():
+    """Cópia do version vector local."""
+    with messages_lock.read():
+        return dict(state.vv)
+
 def create_message(username, text):
     """Cria um novo objeto de mensagem com ID único usando node_id e contador."""
-    with lock:
+    with messages_lock.write():
         state.local_counter += 1
         counter = state.local_counter
-    msg_id = f"{state.node_id}-{counter}-{uuid.uuid4().hex[:6]}"
     timestamp = datetime.utcnow().isoformat() + "Z"
     return {
-        "id": msg_id,
+        "id": f"{state.node_id}-{counter}-{_fast_hex6()}",
         "node_id": state.node_id,
         "counter": counter,
+        "lamport": lamport_key(counter, state.node_id),
         "timestamp": timestamp,
         "user": username,
         "text": text
@@ -102,24 +693,66 @@ def create_message(username, text):
 
 def add_message_local(msg):
     """Adiciona mensagem localmente se ainda não existir (id unique)."""
-    with lock:
-        if msg["id"] in state.message_ids:
-            return False
-        state.messages.append(msg)
-        state.message_ids.add(msg["id"])
-        # opcional: ordenar por timestamp para leitura cronológica
-        state.messages.sort(key=lambda m: m["timestamp"])
-        # persistir após alteração
-        state._persist()
-        return True
-
-def replicate_to_peer(peer_url, msg):
-    """Envia uma replicação para um peer (POST /replicate)."""
+    return add_messages_bulk([msg]) == 1
+
+def add_messages_bulk(msgs):
+    """
+    Adiciona várias mensagens (ex.: lote replicado ou reconciliação) em uma única seção
+    crítica do mural. Mensagens com formato inválido são ignoradas. Retorna quantas eram novas.
+    """
+    # fora da trava: valida, calcula a chave de ordenação e descarta duplicatas já conhecidas
+    # (comuns na replicação), que assim nem tocam a trava do mural
+    candidates = [(order_key(m), m) for m in msgs
+                  if valid_message(m) and m["id"] not in state.message_ids]
+    if not candidates:
+        return 0
+    with messages_lock.write():
+        # a reserva do ID acontece só aqui, quando nada mais pode falhar antes da inserção
+        new = [(key, m) for key, m in candidates if state.message_ids.add(m["id"])]
+        if not new:
+            return 0
+        if len(new) <= 8:
+            # poucas mensagens: insere na posição ordenada (Lamport) sem reordenar tudo
+            for key, msg in new:
+                idx = bisect.bisect_right(state.message_keys, key)
+                state.message_keys.insert(idx, key)
+                state.messages.insert(idx, msg)
+        else:
+            # lote grande: uma única ordenação (timsort aproveita o trecho já ordenado)
+            state.messages.extend(m for _, m in new)
+            state.messages.sort(key=order_key)
+            state.message_keys = [order_key(m) for m in state.messages]
+        new = [m for _, m in new]
+        # atualização de Lamport: o relógio local avança além de qualquer contador recebido
+        state.local_counter = max(state.local_counter, max(m["counter"] for m in new))
+        state.merkle.add_many(new)
+        for msg in new:
+            update_vv(state.vv, msg)
+        state._bloom = None
+        state._msgs_cache = None
+        # enfileira para o log; o flusher agrupa as gravações
+        state._pending.extend(new)
+        state._dirty.set()
+    return len(new)
+
+REPLICATION_BATCH_INTERVAL = 0.05  # segundos entre envios de lote para cada peer
+REPLICATION_BATCH_SIZE = 64  # máximo de mensagens por POST /replicate_batch
+REPLICATION_QUEUE_MAX = 10_000  # fila por peer; excedentes são recuperados na reconciliação
+
+def replicate_batch_to_peer(peer_url, msgs):
+    """Envia um lote de mensagens para um peer (POST /replicate_batch)."""
     try:
-        url = f"{peer_url.rstrip('/')}/replicate"
+        url = f"{peer_url.rstrip('/')}/replicate_batch"
         # Timeout curto para não bloquear demais
-        resp = requests.post(url, json={"message": msg, "from": state.node_id}, timeout=3)
+        data, headers = json_body({"messages": msgs, "from": state.node_id})
+        resp = state.http.post(url, data=data, headers=headers, timeout=3)
         if resp.status_code == 200:
+            # lote entregue. A resposta traz o version vector do peer; a comparação (e a eventual
+            # busca do delta) roda em outra tarefa do pool para não segurar a fila deste peer
+            try:
+                state.pool.submit(pull_from_reply, peer_url, resp.content)
+            except RuntimeError:
+                pass  # pool já encerrado (processo saindo); o lote foi entregue mesmo assim
             return True
         else:
             print(f"[{state.node_id}] Replicação para {peer_url} retornou {resp.status_code}")
@@ -127,32 +760,103 @@ def replicate_to_peer(peer_url, msg):
     except Exception as e:
         # print erro de rede (peer down ou não acessível)
         # para eventual consistência, não falhamos aqui; mensagens serão re-enviadas quando o nó for reconciliado.
-        # Em produção, usar fila de retry com backoff.
         print(f"[{state.node_id}] Erro replicando para {peer_url}: {e}")
         return False
 
+VV_GAP_GRACE = 2.0  # segundos que uma lacuna de version vector precisa persistir para disparar a busca
+
+def valid_vv(vv):
+    """Version vector bem formado: {str: int >= 0}."""
+    return isinstance(vv, dict) and all(
+        isinstance(node, str) and _is_int(counter, MAX_COUNTER) for node, counter in vv.items())
+
+def pull_from_reply(peer_url, body):
+    """Lê o version vector da resposta de /replicate_batch e chama pull_if_behind."""
+    try:
+        reply = json_loads(body)
+        if isinstance(reply, dict):
+            pull_if_behind(peer_url, reply.get("vv"))
+    except Exception as e:
+        print(f"[{state.node_id}] Erro comparando version vector de {peer_url}: {e}")
+
+def pull_if_behind(peer_url, peer_vv):
+    """
+    Gossip push-pull: compara o version vector do peer com o local e, se o peer estiver à frente
+    para algum nó, busca só as mensagens posteriores ao que já temos (GET /messages_since).
+
+    Atraso normal de replicação não dispara a busca: uma lacuna só conta quando continua aberta
+    em respostas desse peer por mais de VV_GAP_GRACE segundos. Isso vale também para as mensagens
+    do próprio peer, cujos lotes podem ter sido descartados (peer fora do ar, fila cheia).
+    """
+    if not valid_vv(peer_vv):
+        return 0
+    local_vv = current_vv()
+    now = time.monotonic()
+    previous = state.vv_gaps.get(peer_url, {})
+    gaps = {}
+    for node, counter in peer_vv.items():
+        if node == state.node_id or counter <= local_vv.get(node, 0):
+            continue
+        # mantém a primeira observação enquanto a lacuna antiga não for preenchida
+        first = previous.get(node)
+        gaps[node] = first if first and local_vv.get(node, 0) < first[0] else (counter, now)
+    state.vv_gaps[peer_url] = gaps
+    if not any(now - seen >= VV_GAP_GRACE for _, seen in gaps.values()):
+        return 0
+    state.vv_gaps[peer_url] = {}
+    status, data = fetch_json_from_peer(peer_url, f"/messages_since?vv={quote(json_dumps(local_vv).decode('utf-8'))}")
+    if status != 200 or not isinstance(data, dict) or not isinstance(data.get("messages"), list):
+        return 0
+    added = add_messages_bulk(data["messages"])
+    if added:
+        print(f"[{state.node_id}] Version vector de {peer_url} à frente: {added} mensagens puxadas")
+    return added
+
+async def _replicate_with_retry(peer, msgs):
+    """Tenta replicar o lote para um peer algumas vezes com backoff exponencial (sem prender threads)."""
+    attempts = 3
+    for i in range(attempts):
+        ok = await state.loop.run_in_executor(state.pool, replicate_batch_to_peer, peer, msgs)
+        if ok:
+            return
+        if i < attempts - 1:
+            await asyncio.sleep(2 ** i)  # backoff exponencial: 1s, 2s
+
+async def _drain_outbox(peer):
+    """
+    Esvazia a fila de saída de um peer: a cada REPLICATION_BATCH_INTERVAL (ou antes, quando
+    a fila atinge REPLICATION_BATCH_SIZE) envia as mensagens acumuladas em lotes.
+    """
+    wakeup = state.outbox_wakeup[peer] = asyncio.Event()
+    queue = state.outbox[peer]
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), REPLICATION_BATCH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        while queue:
+            batch = [queue.popleft() for _ in range(min(len(queue), REPLICATION_BATCH_SIZE))]
+            await _replicate_with_retry(peer, batch)
+
 def async_replicate(msg):
     """Replica a mensagem assincronamente para todos os peers (não espera confirmação)."""
-    # Para não bloquear a request do usuário, fazemos isso em threads separadas.
-    def worker(peer):
-        # Tenta replicar algumas vezes com backoff simples
-        attempts = 3
-        for i in range(attempts):
-            ok = replicate_to_peer(peer, msg)
-            if ok:
-                return
-            time.sleep(1 + i)  # backoff simples
+    # Para não bloquear a request do usuário, só enfileiramos; o event loop de replicação
+    # agrupa as mensagens de uma rajada em um único POST por peer.
     for peer in state.peers:
-        t = threading.Thread(target=worker, args=(peer,), daemon=True)
-        t.start()
+        queue = state.outbox[peer]
+        queue.append(msg)
+        wakeup = state.outbox_wakeup.get(peer)
+        if wakeup is not None and len(queue) >= REPLICATION_BATCH_SIZE:
+            state.loop.call_soon_threadsafe(wakeup.set)
 
 def fetch_messages_from_peer(peer_url):
     """Pega todas as mensagens do peer (GET /messages) - usado para reconciliação."""
     try:
         url = f"{peer_url.rstrip('/')}/messages"
-        resp = requests.get(url, timeout=4)
+        resp = state.http.get(url, timeout=4)
         if resp.status_code == 200:
-            data = resp.json()
+            data = json_loads(resp.content)
             return data.get("messages", [])
         else:
             print(f"[{state.node_id}] fetch_messages_from_peer {peer_url} status {resp.status_code}")
@@ -161,21 +865,108 @@ def fetch_messages_from_peer(peer_url):
         print(f"[{state.node_id}] Erro ao buscar mensagens de {peer_url}: {e}")
         return []
 
+def fetch_json_from_peer(peer_url, path):
+    """GET genérico em um peer; retorna (status, dados) ou (None, None) em erro de rede."""
+    try:
+        resp = state.http.get(f"{peer_url.rstrip('/')}{path}", timeout=4)
+        if resp.status_code != 200:
+            return resp.status_code, None
+        return resp.status_code, json_loads(resp.content)
+    except Exception as e:
+        print(f"[{state.node_id}] Erro ao consultar {path} em {peer_url}: {e}")
+        return None, None
+
+def post_json_to_peer(peer_url, path, obj):
+    """POST genérico em um peer; retorna (status, dados) ou (None, None) em erro de rede."""
+    try:
+        data, headers = json_body(obj)
+        resp = state.http.post(f"{peer_url.rstrip('/')}{path}", data=data, headers=headers, timeout=4)
+        if resp.status_code != 200:
+            return resp.status_code, None
+        return resp.status_code, json_loads(resp.content)
+    except Exception as e:
+        print(f"[{state.node_id}] Erro ao enviar {path} para {peer_url}: {e}")
+        return None, None
+
+def local_bloom():
+    """Filtro de Bloom serializado dos IDs locais (cacheado até a próxima alteração do mural)."""
+    with messages_lock.read():
+        bloom = state._bloom
+        if bloom is None:
+            bloom = BloomFilter.for_items([m["id"] for m in state.messages]).to_dict()
+            state._bloom = bloom
+    return bloom
+
+def fetch_missing_via_bloom(peer_url):
+    """Envia o filtro de Bloom local e recebe do peer, em uma ida e volta, as mensagens ausentes."""
+    status, data = post_json_to_peer(peer_url, "/messages_missing", {"bloom": local_bloom()})
+    if status != 200:
+        return []
+    return data.get("messages", [])
+
+MERKLE_STRIDE = 5  # níveis da árvore descidos por requisição na comparação com o peer
+
+def merkle_diff_buckets(peer_url):
+    """
+    Compara a árvore de Merkle local com a do peer, descendo só pelas subárvores com hash
+    diferente: cada requisição traz MERKLE_STRIDE níveis de descendentes dos nós divergentes.
+    Retorna a lista de buckets divergentes ou None se o peer não suportar Merkle.
+    """
+    tree = state.merkle
+    status, data = fetch_json_from_peer(peer_url, "/merkle/root")
+    if status != 200:
+        return None if status == 404 else []
+    if data.get("leaves") != tree.leaves or data.get("span") != tree.span:
+        return None
+    with messages_lock.read():
+        local_root = tree.root()
+    if data.get("root") == local_root:
+        return []
+    frontier = [1]
+    depth = 0
+    while depth < tree.depth:
+        step = min(MERKLE_STRIDE, tree.depth - depth)
+        indices = [j for i in frontier for j in range(i << step, (i + 1) << step)]
+        status, data = post_json_to_peer(peer_url, "/merkle/nodes", {"indices": indices})
+        if status != 200:
+            return []
+        with messages_lock.read():
+            local = tree.hashes(indices)
+        frontier = [j for j, remote, mine in zip(indices, data.get("hashes", []), local) if remote != mine]
+        if not frontier:
+            return []
+        depth += step
+    return [i - tree.leaves for i in frontier]
+
+def fetch_missing_from_peer(peer_url):
+    """Busca no peer apenas as mensagens dos buckets cuja hash difere da local."""
+    buckets = merkle_diff_buckets(peer_url)
+    if buckets is None:
+        # peer sem suporte a Merkle: cai para a busca completa
+        return fetch_messages_from_peer(peer_url)
+    if not buckets:
+        return []
+    status, data = post_json_to_peer(peer_url, "/messages_in_buckets", {"buckets": buckets})
+    if status != 200:
+        return []
+    return data.get("messages", [])
+
 def reconcile_with_peers():
     """
     Compara mensagens com peers e puxa as que faltam.
-    Estratégia simples: para cada peer, pede todas as mensagens e adiciona as que faltam.
-    (Ineficiente para grande escala, mas atende requisito de consistência eventual.)
+    Estratégia: primeiro envia um filtro de Bloom dos IDs locais e recebe o delta em uma
+    ida e volta; depois compara as árvores de Merkle para recuperar o que o Bloom deixou
+    passar (falsos positivos), buscando só os buckets divergentes.
     """
     print(f"[{state.node_id}] Iniciando reconciliação com peers...")
     total_added = 0
     for peer in state.peers:
-        peer_messages = fetch_messages_from_peer(peer)
-        # adiciona sem duplicar
-        for msg in peer_messages:
-            added = add_message_local(msg)
-            if added:
-                total_added += 1
+        for fetch in (fetch_missing_via_bloom, fetch_missing_from_peer):
+            peer_messages = fetch(peer)
+            if not isinstance(peer_messages, list):
+                continue
+            # adiciona sem duplicar (add_messages_bulk descarta mensagens com formato inválido)
+            total_added += add_messages_bulk(peer_messages)
     print(f"[{state.node_id}] Reconciliação completa. Mensagens adicionadas: {total_added}")
     return total_added
 
@@ -188,7 +979,7 @@ def route_login():
     - Request JSON: {"username": "...", "password": "..."}
     - Response: {"token": "..."} (use token no header Authorization: Bearer <token>)
     """
-    data = request.get_json(force=True, silent=True)
+    data = request_json()
     if not data:
         return jsonify({"error": "JSON required"}), 400
     username = data.get("username")
@@ -196,10 +987,10 @@ def route_login():
     if not username or not password:
         return jsonify({"error": "username and password required"}), 400
     # autenticação simples
-    if state.users.get(username) == password:
+    stored = state.users.get(username)
+    if stored and verify_password(password, stored):
         token = uuid.uuid4().hex
-        with lock:
-            state.sessions[token] = {"user": username, "created": time.time()}
+        state.sessions.set(token, {"user": username, "created": time.time()})
         return jsonify({"token": token})
     else:
         return jsonify({"error": "invalid credentials"}), 401
@@ -210,12 +1001,41 @@ def get_user_from_token():
     if not auth.startswith("Bearer "):
         return None
     token = auth.split(" ", 1)[1].strip()
-    with lock:
-        sess = state.sessions.get(token)
+    user = state.token_cache.get(token)
+    if user:
+        return user
+    sess = state.sessions.get(token)
     if not sess:
         return None
+    now = time.time()
+    if state.session_expired(sess, now):
+        state.sessions.pop(token)
+        return None
+    # o cache nunca guarda o token além da validade da sessão
+    state.token_cache.set(token, sess["user"], ttl=sess["created"] + state.session_ttl - now)
+    # se um logout concorrente removeu a sessão enquanto cacheávamos, desfaz o cache
+    if state.sessions.get(token) is None:
+        state.token_cache.pop(token)
+        return None
     return sess["user"]
 
+@app.route("/logout", methods=["POST"])
+def route_logout():
+    """
+    Logout (invalida o token):
+    - Header: Authorization: Bearer <token>
+    """
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return jsonify({"error": "authentication required"}), 401
+    token = auth.split(" ", 1)[1].strip()
+    # remove a sessão antes do cache: uma leitura concorrente não consegue repopular o cache
+    sess = state.sessions.pop(token)
+    state.token_cache.pop(token)
+    if not sess:
+        return jsonify({"error": "invalid token"}), 401
+    return jsonify({"status": "ok"})
+
 @app.route("/post", methods=["POST"])
 def route_post():
     """
@@ -226,7 +1046,7 @@ def route_post():
     user = get_user_from_token()
     if not user:
         return jsonify({"error": "authentication required"}), 401
-    data = request.get_json(force=True, silent=True)
+    data = request_json()
     if not data or "text" not in data:
         return jsonify({"error": "text required"}), 400
     text = data["text"].strip()
@@ -240,7 +1060,7 @@ def route_post():
         return jsonify({"error": "message already exists (duplicated id)"}), 409
 
     # replicação assíncrona para peers (não espera confirmação)
-    threading.Thread(target=async_replicate, args=(msg,), daemon=True).start()
+    async_replicate(msg)
     return jsonify({"status": "ok", "message": msg}), 201
 
 @app.route("/messages", methods=["GET"])
@@ -249,9 +1069,93 @@ def route_messages():
     Ler mensagens públicas (não requer autenticação).
     Retorna todas as mensagens locais (cópia do mural do nó).
     """
-    with lock:
-        # devolve cópia para segurança
-        return jsonify({"messages": list(state.messages)})
+    cache = messages_cache()
+    # cada representação (identidade ou gzip) tem seu próprio ETag forte
+    compressed = (len(cache["body"]) >= COMPRESS_MIN_SIZE
+                  and "gzip" in request.headers.get("Accept-Encoding", "").lower())
+    etag = cache["etag"] + "-gz" if compressed else cache["etag"]
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    if compressed:
+        if "gzip" not in cache:
+            cache["gzip"] = gzip.compress(cache["body"], COMPRESS_LEVEL)
+        response = Response(cache["gzip"], mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(cache["body"], mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+def messages_cache():
+    """Corpo serializado de /messages e seu ETag, recalculados só após alterações no mural."""
+    cache = state._msgs_cache
+    if cache is None:
+        # a trava de leitura cobre toda a serialização, então não é preciso copiar o mural
+        with messages_lock.read():
+            body = json_dumps({"messages": state.messages})
+            cache = {"body": body, "etag": hashlib.sha256(body).hexdigest()}
+            state._msgs_cache = cache
+    return cache
+
+@app.route("/merkle/root", methods=["GET"])
+def route_merkle_root():
+    """Hash da raiz da árvore de Merkle local e sua forma (usado na reconciliação)."""
+    with messages_lock.read():
+        return jsonify({"root": state.merkle.root(), "leaves": state.merkle.leaves, "span": state.merkle.span})
+
+def _int_list(data, key, limit):
+    """Lista de inteiros em data[key] (até `limit` itens) ou None se inválida."""
+    values = data.get(key) if isinstance(data, dict) else None
+    if (not isinstance(values, list) or len(values) > limit
+            or not all(type(v) is int for v in values)):
+        return None
+    return values
+
+@app.route("/merkle/nodes", methods=["POST"])
+def route_merkle_nodes():
+    """
+    Hashes de vários nós da árvore de Merkle em uma requisição (raiz = 1).
+    Corpo JSON: {"indices": [i, ...]} -> {"hashes": ["<hex>" ou null, ...]}
+    """
+    indices = _int_list(request_json(allow_gzip=True), "indices", 2 * state.merkle.leaves)
+    if indices is None:
+        return jsonify({"error": "indices required"}), 400
+    with messages_lock.read():
+        return jsonify({"hashes": state.merkle.hashes(indices)})
+
+@app.route("/messages_in_buckets", methods=["POST"])
+def route_messages_in_buckets():
+    """
+    Mensagens de vários buckets (folhas) da árvore de Merkle.
+    Corpo JSON: {"buckets": [b, ...]}
+    """
+    buckets = _int_list(request_json(allow_gzip=True), "buckets", state.merkle.leaves)
+    if buckets is None:
+        return jsonify({"error": "buckets required"}), 400
+    with messages_lock.read():
+        messages = []
+        for b in set(buckets):
+            messages.extend(state.merkle.bucket(b) or [])
+        return json_response({"messages": messages})
+
+@app.route("/messages_missing", methods=["POST"])
+def route_messages_missing():
+    """
+    Devolve as mensagens locais cujo ID não está no filtro de Bloom enviado pelo peer.
+    Corpo JSON: {"bloom": {"m": <bits>, "k": <hashes>, "bits": "<base64>"}}
+    """
+    data = request_json(allow_gzip=True)
+    if not isinstance(data, dict) or "bloom" not in data:
+        return jsonify({"error": "bloom required"}), 400
+    try:
+        bloom = BloomFilter.from_dict(data["bloom"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "invalid bloom filter"}), 400
+    with messages_lock.read():
+        missing = [m for m in state.messages if m["id"] not in bloom]
+    return json_response({"messages": missing})
 
 @app.route("/replicate", methods=["POST"])
 def route_replicate():
@@ -264,16 +1168,57 @@ def route_replicate():
         # Respondemos 503 para indicar indisponibilidade (ou poderíamos simplesmente ignorar)
         return jsonify({"error": "node not accepting replication (simulated down)"}), 503
 
-    data = request.get_json(force=True, silent=True)
-    if not data or "message" not in data:
+    data = request_json(allow_gzip=True)
+    if not isinstance(data, dict) or "message" not in data:
         return jsonify({"error": "message required"}), 400
     msg = data["message"]
+    # mensagem com formato inválido é descartada por add_messages_bulk (added = false)
     added = add_message_local(msg)
     if added:
         # opcional: log
         print(f"[{state.node_id}] Mensagem replicada recebida: {msg['id']} from {data.get('from')}")
     # Retorna 200 sempre que possível — o replicador faz retries se necessário.
-    return jsonify({"status": "ok", "added": added})
+    return jsonify({"status": "ok", "added": added, "vv": current_vv()})
+
+@app.route("/replicate_batch", methods=["POST"])
+def route_replicate_batch():
+    """
+    Endpoint usado por peers para replicar um lote de mensagens.
+    Corpo JSON: {"messages": [{...}, ...], "from": "<node_id>"}
+    """
+    if not state.accept_replication:
+        return jsonify({"error": "node not accepting replication (simulated down)"}), 503
+
+    data = request_json(allow_gzip=True)
+    if not isinstance(data, dict) or not isinstance(data.get("messages"), list):
+        return jsonify({"error": "messages required"}), 400
+    # mensagens com formato inválido são descartadas uma a uma; as válidas do lote entram
+    added = add_messages_bulk(data["messages"])
+    if added:
+        print(f"[{state.node_id}] Lote replicado recebido: {added} mensagens novas from {data.get('from')}")
+    # devolve o version vector local para o remetente detectar o que lhe falta
+    return jsonify({"status": "ok", "added": added, "vv": current_vv()})
+
+@app.route("/vv", methods=["GET"])
+def route_vv():
+    """Version vector local: {node_id: maior contador visto}."""
+    return jsonify({"vv": current_vv()})
+
+@app.route("/messages_since", methods=["GET"])
+def route_messages_since():
+    """
+    Mensagens posteriores a um version vector (usado no gossip push-pull).
+    Query: ?vv={"node1": 10, ...} -> mensagens com counter > vv[node_id] (0 se ausente).
+    """
+    try:
+        vv = json_loads(request.args.get("vv", "{}"))
+    except ValueError:
+        return jsonify({"error": "invalid vv"}), 400
+    if not valid_vv(vv):
+        return jsonify({"error": "invalid vv"}), 400
+    with messages_lock.read():
+        messages = [m for m in state.messages if m.get("counter", 0) > vv.get(m.get("node_id", ""), 0)]
+    return json_response({"messages": messages})
 
 @app.route("/simulate_fail", methods=["POST"])
 def route_simulate_fail():
@@ -283,7 +1228,7 @@ def route_simulate_fail():
     - "down": passa a rejeitar /replicate (simula queda)
     - "up": volta a aceitar e automaticamente reconcilia com peers
     """
-    data = request.get_json(force=True, silent=True)
+    data = request_json()
     if not data or "action" not in data:
         return jsonify({"error": "action required ('down' or 'up')"}), 400
     action = data["action"]
@@ -324,16 +1269,39 @@ def parse_args():
     parser.add_argument("--port", type=int, required=True, help="Porta HTTP do nó (ex: 5001)")
     parser.add_argument("--peers", default="", help="Lista de peers (URLs) separados por vírgula, ex: http://localhost:5002,http://localhost:5003")
     parser.add_argument("--host", default="0.0.0.0", help="Host para bind Flask (default 0.0.0.0)")
-    return parser.parse_args()
+    parser.add_argument("--persist-interval", type=float, default=0.5, help="Intervalo (s) para agrupar gravações do mural em disco (default 0.5)")
+    parser.add_argument("--session-ttl", type=int, default=3600, help="Validade (s) dos tokens de login (default 3600)")
+    args = parser.parse_args()
+    if not 0 <= args.persist_interval < float("inf"):
+        parser.error("--persist-interval deve ser um número finito maior ou igual a zero")
+    if args.session_ttl <= 0:
+        parser.error("--session-ttl deve ser maior que zero")
+    return args
 
-def main():
+def parse_peers(peers):
+    """Converte "http://a:1,http://b:2" em lista de URLs."""
+    return [p.strip() for p in peers.split(",") if p.strip()]
+
+def init_node(node_id, port, peers, persist_interval=0.5, session_ttl=3600):
+    """Cria o estado do nó e inicia as threads de persistência, replicação e limpeza de sessões."""
     global state
-    args = parse_args()
-    peers = [p.strip() for p in args.peers.split(",") if p.strip()]
-    state = NodeState(node_id=args.node_id, port=args.port, peers=peers)
+    # valores inválidos derrubariam em silêncio as threads de persistência/limpeza (time.sleep)
+    if not 0 <= persist_interval < float("inf"):
+        raise ValueError("persist_interval deve ser um número finito maior ou igual a zero")
+    if session_ttl <= 0:
+        raise ValueError("session_ttl deve ser maior que zero")
+    state = NodeState(node_id=node_id, port=port, peers=peers, persist_interval=persist_interval,
+                      session_ttl=session_ttl)
+    state.start_persistence()
+    state.start_replicator()
+    state.start_session_sweeper()
+    print(f"[{state.node_id}] Iniciando nó na porta {port}. Peers: {state.peers}")
+    return state
 
-    print(f"[{state.node_id}] Iniciando nó na porta {args.port}. Peers: {state.peers}")
-    # start Flask (bloqueia). Em cenários de produção, usar Gunicorn / uWSGI.
+def main():
+    args = parse_args()
+    init_node(args.node_id, args.port, parse_peers(args.peers), args.persist_interval, args.session_ttl)
+    # start Flask (bloqueia). Em produção (Linux), usar gunicorn com wsgi.py (ver README).
     start_flask(args.host, args.port)
 
 if __name__ == "__main__":
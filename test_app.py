@@ -0,0 +1,398 @@
+"""
+Testes unitários do app.py (estruturas internas e rotas via cliente de teste do Flask).
+
+Rodar com:
+    python -m unittest test_app
+"""
+
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+
+
+def setUpModule():
+    # os nós gravam o log (messages_<node_id>.ndjson) no diretório atual
+    global _old_cwd, _tmp_dir
+    _old_cwd = os.getcwd()
+    _tmp_dir = tempfile.mkdtemp(prefix="mural-test-")
+    os.chdir(_tmp_dir)
+
+
+def tearDownModule():
+    os.chdir(_old_cwd)
+    shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+_node_seq = 0
+
+
+def next_node_id():
+    global _node_seq
+    _node_seq += 1
+    return f"t{_node_seq}"
+
+
+def make_node(node_id=None, **kwargs):
+    """Inicia um nó isolado (sem peers, log próprio) e devolve um cliente de teste do Flask."""
+    app.init_node(node_id or next_node_id(), 0, [], **kwargs)
+    return app.app.test_client()
+
+
+def make_msgs(n, nodes=("n1", "n2", "n3")):
+    """Gera n mensagens válidas com contadores de Lamport espalhados entre vários nós."""
+    msgs = []
+    for i in range(n):
+        node = nodes[i % len(nodes)]
+        counter = i * 3 + 1
+        msgs.append({"id": f"{node}-{counter}-{i:04x}", "node_id": node, "counter": counter,
+                     "user": "alice", "text": f"msg {i}"})
+    return msgs
+
+
+class MerkleTreeTest(unittest.TestCase):
+    def test_root_independe_da_ordem_de_insercao(self):
+        msgs = make_msgs(500)
+        shuffled = msgs[:]
+        random.Random(42).shuffle(shuffled)
+
+        a = app.MerkleTree()
+        a.add_many(msgs)
+        b = app.MerkleTree()
+        for i in range(0, len(shuffled), 37):  # lotes de tamanhos variados
+            b.add_many(shuffled[i:i + 37])
+        c = app.MerkleTree()
+        c.rebuild(shuffled)
+
+        self.assertEqual(a.root(), b.root())
+        self.assertEqual(a.root(), c.root())
+
+    def test_root_muda_com_conjunto_diferente(self):
+        msgs = make_msgs(100)
+        a = app.MerkleTree()
+        a.add_many(msgs)
+        b = app.MerkleTree()
+        b.add_many(msgs[:-1])
+        self.assertNotEqual(a.root(), b.root())
+
+    def test_bucket_fora_do_intervalo(self):
+        tree = app.MerkleTree(leaves=16)
+        self.assertIsNone(tree.bucket(16))
+        self.assertIsNone(tree.bucket(-1))
+        self.assertEqual(tree.hashes([0, 1, 32]), [None, tree.root(), None])
+
+
+class BloomFilterTest(unittest.TestCase):
+    def test_round_trip_sem_falsos_negativos(self):
+        ids = [m["id"] for m in make_msgs(2000)]
+        bloom = app.BloomFilter.for_items(ids)
+        copy = app.BloomFilter.from_dict(app.json_loads(app.json_dumps(bloom.to_dict())))
+
+        self.assertEqual((copy.m, copy.k, copy.bits), (bloom.m, bloom.k, bloom.bits))
+        for item in ids:
+            self.assertIn(item, copy)
+
+    def test_taxa_de_falsos_positivos(self):
+        bloom = app.BloomFilter.for_items([f"in-{i}" for i in range(2000)])
+        false_pos = sum(f"out-{i}" in bloom for i in range(10000))
+        self.assertLess(false_pos / 10000, 0.03)  # ~1% esperado com 10 bits/elemento e k=7
+
+    def test_from_dict_rejeita_parametros_invalidos(self):
+        for field, value in (("m", 4096), ("m", 0), ("k", 0), ("k", 200000)):
+            data = app.BloomFilter(1024).to_dict()
+            data[field] = value
+            with self.subTest(field=field, value=value), self.assertRaises(ValueError):
+                app.BloomFilter.from_dict(data)
+
+    def test_rota_messages_missing(self):
+        client = make_node()
+        msgs = make_msgs(20)
+        client.post("/replicate_batch", json={"messages": msgs})
+        bloom = app.BloomFilter.for_items([m["id"] for m in msgs[:15]])
+        resp = client.post("/messages_missing", json={"bloom": bloom.to_dict()})
+        self.assertEqual({m["id"] for m in resp.get_json()["messages"]}, {m["id"] for m in msgs[15:]})
+        bad = dict(bloom.to_dict(), k=200000)
+        self.assertEqual(client.post("/messages_missing", json={"bloom": bad}).status_code, 400)
+        self.assertEqual(client.post("/messages_missing", json=["bloom"]).status_code, 400)
+
+
+class FakeClock:
+    """Relógio manual para os testes de expiração (substitui time.monotonic só onde é injetado)."""
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_entrada_expira(self):
+        clock = FakeClock()
+        cache = app.TTLCache(ttl=10, clock=clock)
+        cache.set("tok", "alice")
+        self.assertEqual(cache.get("tok"), "alice")
+        clock.now += 10.5
+        self.assertIsNone(cache.get("tok"))
+
+    def test_ttl_por_entrada_nao_passa_do_padrao(self):
+        clock = FakeClock()
+        cache = app.TTLCache(ttl=10, clock=clock)
+        cache.set("curto", 1, ttl=2)
+        cache.set("longo", 2, ttl=60)
+        clock.now += 3
+        self.assertIsNone(cache.get("curto"))
+        self.assertEqual(cache.get("longo"), 2)
+        clock.now += 8
+        self.assertIsNone(cache.get("longo"))
+
+    def test_descarta_mais_antiga_ao_encher(self):
+        cache = app.TTLCache(maxsize=3, ttl=60)
+        for key in ("a", "b", "c"):
+            cache.set(key, key)
+        cache.set("a", "a2")  # regravar move "a" para o fim
+        cache.set("d", "d")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([cache.get(k) for k in ("a", "c", "d")], ["a2", "c", "d"])
+        self.assertEqual(len(cache._data), 3)
+
+    def test_logout_invalida_token_cacheado(self):
+        client = make_node()
+        token = client.post("/login", json={"username": "alice", "password": "password1"}).get_json()["token"]
+        auth = {"Authorization": f"Bearer {token}"}
+        self.assertEqual(client.post("/post", json={"text": "oi"}, headers=auth).status_code, 201)
+        self.assertEqual(client.post("/logout", headers=auth).status_code, 200)
+        self.assertIsNone(app.state.token_cache.get(token))
+        self.assertEqual(client.post("/post", json={"text": "oi"}, headers=auth).status_code, 401)
+
+
+class PersistenceTest(unittest.TestCase):
+    def read_log(self, node):
+        with open(node.persist_file, "rb") as f:
+            return f.read().split(b"\n")
+
+    def test_falha_ao_gravar_devolve_o_lote(self):
+        # intervalo longo: o flusher não grava sozinho durante o teste
+        client = make_node(persist_interval=3600)
+        node = app.state
+        client.post("/replicate_batch", json={"messages": make_msgs(5)})
+        with mock.patch.object(node, "_append", side_effect=OSError("disco cheio")):
+            node._persist()
+        self.assertEqual(len(node._pending), 5)
+        self.assertTrue(node._dirty.is_set())
+
+        node._persist()
+        self.assertEqual(node._pending, [])
+        lines = [line for line in self.read_log(node) if line]
+        self.assertEqual(sorted(app.json_loads(line)["id"] for line in lines),
+                         sorted(m["id"] for m in make_msgs(5)))
+
+    def test_linha_truncada_nao_corrompe_o_proximo_registro(self):
+        node_id = next_node_id()
+        first, second = make_msgs(2)
+        with open(f"messages_{node_id}.ndjson", "wb") as f:
+            f.write(app.json_dumps(first) + b"\n" + b'{"id": "trunc')
+        client = make_node(node_id, persist_interval=3600)
+        node = app.state
+        self.assertEqual([m["id"] for m in node.messages], [first["id"]])
+
+        client.post("/replicate_batch", json={"messages": [second]})
+        node.flush_now()
+        lines = self.read_log(node)
+        self.assertEqual(lines[1], b'{"id": "trunc')
+        self.assertEqual(app.json_loads(lines[2])["id"], second["id"])
+
+
+class MessagesCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_node()
+        self.client.post("/replicate_batch", json={"messages": make_msgs(100)})
+
+    def get(self, etag=None, gz=False):
+        headers = {"Accept-Encoding": "gzip"} if gz else {"Accept-Encoding": "identity"}
+        if etag:
+            headers["If-None-Match"] = f'"{etag}"'
+        return self.client.get("/messages", headers=headers)
+
+    def test_etag_por_representacao(self):
+        plain, packed = self.get(), self.get(gz=True)
+        self.assertIsNone(plain.headers.get("Content-Encoding"))
+        self.assertEqual(packed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(packed.data), plain.data)
+        etag, etag_gz = plain.get_etag()[0], packed.get_etag()[0]
+        self.assertNotEqual(etag, etag_gz)
+
+        self.assertEqual(self.get(etag).status_code, 304)
+        self.assertEqual(self.get(etag_gz, gz=True).status_code, 304)
+        # o ETag de uma representação não valida a outra
+        resp = self.get(etag, gz=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_etag()[0], etag_gz)
+        self.assertEqual(self.get(etag_gz).status_code, 200)
+
+    def test_etag_muda_quando_o_mural_muda(self):
+        etag = self.get().get_etag()[0]
+        self.client.post("/replicate_batch", json={"messages": make_msgs(1, nodes=("n9",))})
+        resp = self.get(etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.get_json()["messages"]), 101)
+
+
+class GzipRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_node()
+
+    def post_gzip(self, path, raw):
+        return self.client.post(path, data=gzip.compress(raw), content_type="application/json",
+                                headers={"Content-Encoding": "gzip"})
+
+    def test_lote_comprimido_de_peer(self):
+        data, headers = app.json_body({"messages": make_msgs(50)})
+        self.assertEqual(headers.get("Content-Encoding"), "gzip")
+        resp = self.client.post("/replicate_batch", data=data, headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()["added"], 50)
+
+    def test_descompressao_limitada(self):
+        raw = b'{"messages": [' + b" " * 100_000 + b"]}"
+        self.assertEqual(self.post_gzip("/replicate_batch", raw).status_code, 200)
+        with mock.patch.object(app, "MAX_REQUEST_BODY", 4096):
+            self.assertEqual(self.post_gzip("/replicate_batch", raw).status_code, 400)
+
+    def test_gzip_so_nos_endpoints_de_peer(self):
+        raw = app.json_dumps({"username": "alice", "password": "password1"})
+        self.assertEqual(self.post_gzip("/login", raw).status_code, 400)
+
+    def test_corpo_grande_demais(self):
+        with mock.patch.dict(app.app.config, {"MAX_CONTENT_LENGTH": 1024}):
+            resp = self.client.post("/replicate_batch", data=b" " * 2048, content_type="application/json")
+        self.assertEqual(resp.status_code, 413)
+
+
+class VersionVectorPullTest(unittest.TestCase):
+    PEER = "http://peer.invalid"
+
+    def setUp(self):
+        make_node()
+        self.lost = make_msgs(1, nodes=("n7",))[0]
+        patcher = mock.patch.object(app, "fetch_json_from_peer",
+                                    return_value=(200, {"messages": [self.lost]}))
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_atraso_normal_nao_dispara_busca(self):
+        for _ in range(5):
+            self.assertEqual(app.pull_if_behind(self.PEER, {"n7": self.lost["counter"]}), 0)
+        self.fetch.assert_not_called()
+
+    def test_lacuna_que_persiste_dispara_busca(self):
+        app.pull_if_behind(self.PEER, {"n7": self.lost["counter"]})
+        with mock.patch.object(app, "VV_GAP_GRACE", 0.0):
+            self.assertEqual(app.pull_if_behind(self.PEER, {"n7": self.lost["counter"]}), 1)
+        self.fetch.assert_called_once()
+        self.assertIn(self.lost["id"], app.state.message_ids)
+
+    def test_ignora_a_propria_entrada_e_vv_invalido(self):
+        with mock.patch.object(app, "VV_GAP_GRACE", 0.0):
+            self.assertEqual(app.pull_if_behind(self.PEER, {app.state.node_id: 10}), 0)
+            self.assertEqual(app.pull_if_behind(self.PEER, {"n7": "10"}), 0)
+        self.fetch.assert_not_called()
+
+    def test_lote_entregue_mesmo_com_resposta_invalida(self):
+        reply = mock.Mock(status_code=200, content=b"[1]")
+        with mock.patch.object(app.state.http, "post", return_value=reply):
+            self.assertTrue(app.replicate_batch_to_peer(self.PEER, make_msgs(1)))
+
+    def test_messages_since_rejeita_vv_invalido(self):
+        client = app.app.test_client()
+        for vv in ('{"n1": "x"}', "[1]", "nao-json"):
+            with self.subTest(vv=vv):
+                self.assertEqual(client.get("/messages_since", query_string={"vv": vv}).status_code, 400)
+
+
+class SessionExpiryTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_node(session_ttl=60)
+        resp = self.client.post("/login", json={"username": "alice", "password": "password1"})
+        self.token = resp.get_json()["token"]
+        self.auth = {"Authorization": f"Bearer {self.token}"}
+
+    def post(self):
+        return self.client.post("/post", json={"text": "oi"}, headers=self.auth)
+
+    def test_sessao_vencida_e_recusada_e_removida(self):
+        self.assertEqual(self.post().status_code, 201)
+        app.state.sessions.get(self.token)["created"] -= 60
+        app.state.token_cache.pop(self.token)
+        self.assertEqual(self.post().status_code, 401)
+        self.assertIsNone(app.state.sessions.get(self.token))
+
+    def test_cache_nao_passa_da_validade_da_sessao(self):
+        app.state.sessions.get(self.token)["created"] -= 55
+        self.assertEqual(self.post().status_code, 201)
+        expires = app.state.token_cache._data[self.token][1]
+        self.assertLessEqual(expires - app.state.token_cache.clock(), 5)
+
+    def test_session_expired_no_limite(self):
+        sess = {"created": 1000.0}
+        self.assertFalse(app.state.session_expired(sess, 1059.9))
+        self.assertTrue(app.state.session_expired(sess, 1060.0))
+
+    def test_rejeita_session_ttl_invalido(self):
+        for value in (0, -1):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                app.init_node("invalido", 0, [], session_ttl=value)
+
+
+class ValidMessageTest(unittest.TestCase):
+    def test_aceita_mensagem_valida(self):
+        self.assertTrue(app.valid_message(make_msgs(1)[0]))
+
+    def test_rejeita_campos_invalidos(self):
+        base = make_msgs(1)[0]
+        for field, value in (("id", 123), ("id", ""), ("node_id", None), ("counter", "5"),
+                             ("counter", -1), ("counter", True), ("counter", 1 << 47),
+                             ("lamport", 1 << 63)):
+            with self.subTest(field=field, value=value):
+                self.assertFalse(app.valid_message(dict(base, **{field: value})))
+        self.assertFalse(app.valid_message(["não", "é", "dict"]))
+
+
+class ReplicateBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_node()
+
+    def test_lote_com_mensagem_invalida_aceita_as_validas(self):
+        good = make_msgs(2)
+        resp = self.client.post("/replicate_batch", json={"messages": [good[0], {"id": 5}, good[1]]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()["added"], 2)
+        ids = [m["id"] for m in self.client.get("/messages").get_json()["messages"]]
+        self.assertEqual(sorted(ids), sorted(m["id"] for m in good))
+
+    def test_id_invalido_nao_fica_reservado(self):
+        msg = make_msgs(1)[0]
+        self.client.post("/replicate_batch", json={"messages": [dict(msg, counter="x")]})
+        resp = self.client.post("/replicate_batch", json={"messages": [msg]})
+        self.assertEqual(resp.get_json()["added"], 1)
+
+    def test_corpo_que_nao_e_objeto(self):
+        for body in ([1], "x", 3, None, {"messages": "x"}):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post("/replicate_batch", json=body).status_code, 400)
+                self.assertEqual(self.client.post("/replicate", json=body).status_code, 400)
+
+
+class InitNodeTest(unittest.TestCase):
+    def test_rejeita_persist_interval_invalido(self):
+        for value in (-1, float("nan"), float("inf")):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                app.init_node("invalido", 0, [], persist_interval=value)
+
+
+if __name__ == "__main__":
+    unittest.main()
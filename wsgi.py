@@ -0,0 +1,26 @@
+"""
+Entrada WSGI para rodar um nó com gunicorn (Linux/macOS).
+
+O nó é configurado por variáveis de ambiente, equivalentes aos argumentos de app.py:
+- NODE_ID (obrigatória), NODE_PORT (obrigatória), NODE_PEERS (URLs separadas por vírgula),
+  PERSIST_INTERVAL (s, >= 0, default 0.5), SESSION_TTL (s, > 0, default 3600)
+  Valores fora desses limites fazem init_node levantar ValueError (o worker não sobe).
+
+Exemplo:
+    NODE_ID=node1 NODE_PORT=5001 NODE_PEERS=http://localhost:5002,http://localhost:5003 \
+        gunicorn -k gthread -w 1 --threads 64 -b 0.0.0.0:5001 wsgi:app
+
+Use sempre -w 1: o mural, as sessões e as filas de replicação vivem na memória do processo.
+"""
+
+import os
+
+from app import app, init_node, parse_peers
+
+init_node(
+    node_id=os.environ["NODE_ID"],
+    port=int(os.environ["NODE_PORT"]),
+    peers=parse_peers(os.environ.get("NODE_PEERS", "")),
+    persist_interval=float(os.environ.get("PERSIST_INTERVAL", "0.5")),
+    session_ttl=int(os.environ.get("SESSION_TTL", "3600")),
+)